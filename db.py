@@ -0,0 +1,136 @@
+import os 
+import asyncio # Used to find the event loop a request runs on
+import atexit # Stops the logging thread when the process exits
+import logging # Used instead of print for startup and error messages
+import queue
+from logging.handlers import QueueHandler, QueueListener # Hand log records to a background thread
+from contextlib import asynccontextmanager # Used to build the app's lifespan (startup/shutdown) handler
+import motor.motor_asyncio # Async MongoDB client for interacting with MongoDB Atlas
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv(dotenv_path=".env")  # Explicit path
+
+
+# ----------------------------- LOGGING -----------------------------
+
+
+# Log records are put on a queue and written to stderr by a background thread,
+# so a request never waits on the stderr lock (e.g. when errors spike under load)
+# Only this app's own loggers are set up, other libraries (pymongo, httpx, ...) keep their default logging
+# Set LOG_LEVEL=DEBUG in .env to see debug messages such as the MongoDB URL
+APP_LOGGERS = ("db", "main")
+LOG_LEVEL = (os.getenv("LOG_LEVEL") or "INFO").upper()
+
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+log_listener = QueueListener(log_queue, log_handler)
+for name in APP_LOGGERS:
+    app_logger = logging.getLogger(name)
+    app_logger.addHandler(QueueHandler(log_queue))
+    # An unknown LOG_LEVEL falls back to INFO instead of stopping the app from starting
+    app_logger.setLevel(LOG_LEVEL if isinstance(logging.getLevelName(LOG_LEVEL), int) else logging.INFO)
+    app_logger.propagate = False # Don't log the same record twice if the server also configures the root logger
+log_listener.start()
+atexit.register(log_listener.stop) # Write out anything still queued before exiting
+
+logger = logging.getLogger(__name__)
+if not isinstance(logging.getLevelName(LOG_LEVEL), int):
+    logger.warning("Unknown LOG_LEVEL %r, using INFO", LOG_LEVEL)
+
+
+# ----------------------------- MONGO DB CONNECTION -----------------------------
+
+
+# Use environment variable for MongoDB connection string
+MONGODB_URL = os.getenv("MONGODB_URL")
+logger.debug("MONGODB_URL: %s", MONGODB_URL)
+
+
+# Connection pool limits, can be overridden in .env
+# (e.g. a lower minimum on Vercel, where every serverless instance opens its own pool)
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "10"))
+
+
+# MongoDB connections, one per event loop: {loop: {"client", "db", "sprites", "audio"}}
+# Every request on the same loop reuses the same client and connection pool
+# (a new client per request meant a new TLS handshake and login before every query).
+# Motor ties a client to the event loop it is first used on and it stops working once that loop is closed,
+# so a server that runs requests on a new loop (e.g. one loop per serverless invocation) gets a client for that loop.
+# Under uvicorn there is a single loop, so this is a single client for the whole process.
+_connections = {}
+
+
+# Function: Get the MongoDB connection of the running event loop, creating it on first use
+def get_connection() -> dict:
+    loop = asyncio.get_running_loop()
+    connection = _connections.get(loop)
+    if connection is None:
+        for old_loop in [old_loop for old_loop in _connections if old_loop.is_closed()]:
+            _connections.pop(old_loop)["client"].close() # Its loop is gone, so it can't be used anymore
+        client = motor.motor_asyncio.AsyncIOMotorClient(
+            MONGODB_URL, maxPoolSize=MONGODB_MAX_POOL_SIZE, minPoolSize=MONGODB_MIN_POOL_SIZE, io_loop=loop
+        )
+        db = client.catgame_db
+        connection = _connections[loop] = {
+            "client": client,
+            "db": db,
+            # GridFS buckets holding the actual sprite and audio file bytes (stored in chunks, so no 16 MB document limit)
+            "sprites": motor.motor_asyncio.AsyncIOMotorGridFSBucket(db, bucket_name="sprites"),
+            "audio": motor.motor_asyncio.AsyncIOMotorGridFSBucket(db, bucket_name="audio"),
+        }
+    return connection
+
+
+# Dependency function that gives each endpoint the shared database handle
+async def get_db():
+    return get_connection()["db"]
+
+
+def get_sprites_bucket():
+    return get_connection()["sprites"]
+
+
+def get_audio_bucket():
+    return get_connection()["audio"]
+
+
+# ----------------------------- STARTUP / SHUTDOWN -----------------------------
+
+
+# Warm up the connection pool on startup so the first request doesn't pay for connecting
+async def connect_db():
+    try:
+        await get_connection()["client"].admin.command("ping")
+    except Exception as e:
+        # Don't stop the app from starting, /ping will report the problem
+        logger.error("Startup ping failed: %s", e)
+
+
+# Create the indexes used by score queries (does nothing if they already exist)
+async def init_indexes():
+    db = get_connection()["db"]
+    try:
+        await db.scores.create_index([("player_name", 1)]) # Look up scores by player
+        # Highest scores first, for leaderboards; including player_name lets /scores/top be answered from the index alone
+        await db.scores.create_index([("score", -1), ("player_name", 1)])
+    except Exception as e:
+        logger.error("Creating indexes failed: %s", e)
+
+
+# Close the pooled connections when the app shuts down
+async def close_db():
+    connection = _connections.pop(asyncio.get_running_loop(), None)
+    if connection is not None:
+        connection["client"].close()
+
+
+# Lifespan: everything above that has to run when the app starts and stops
+@asynccontextmanager
+async def lifespan(app):
+    await connect_db()
+    await init_indexes()
+    yield
+    await close_db()
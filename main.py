@@ -1,50 +1,484 @@
 from fastapi import HTTPException # Used for raising HTTP error responses
-import os 
-from fastapi.responses import JSONResponse # Allows custom response formatting (not directly used here)
-from fastapi import FastAPI, File, UploadFile, Depends # Core FastAPI modules
-from pydantic import BaseModel # For input validation using data models
-import motor.motor_asyncio # Async MongoDB client for interacting with MongoDB Atlas
-from typing import List  # Allows defining endpoints that accept a list of inputs
-import base64 # Used to convert binary files to base64 strings for safe storage in MongoDB
-from dotenv import load_dotenv
+import re # Used for the compiled pattern that screens score updates
+import asyncio # Used to run CPU-heavy base64 work in a worker thread instead of on the event loop
+import binascii # Error raised for invalid base64
+import hashlib # blake2b hashes for the ETags of list responses
+import logging # Error logging (configured in db.py)
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse # Allows custom response formatting (raw files, streamed lists)
+from fastapi import FastAPI, File, UploadFile, Depends, Request, Query # Core FastAPI modules
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints, ValidationError # For input validation using data models
+from typing import Annotated, List, Optional  # Allows defining endpoints that accept a list of inputs / optional parameters
+import pybase64 # SIMD-accelerated base64, converts between stored bytes and the base64 strings used in JSON
 from bson import ObjectId
+from bson.binary import Binary # Stores small files as raw bytes inside their document
+from gridfs import DEFAULT_CHUNK_SIZE # Size of the chunks GridFS splits stored files into
+from pymongo import UpdateOne # One update inside a bulk_write batch
+import orjson # Fast JSON encoder used when streaming documents
+import zstandard # Compresses files stored inline in their document
+from cachetools import TTLCache # Keeps recent list responses in memory for a while
+from starlette.datastructures import Headers # Reads request headers inside plain ASGI middleware
+from starlette.middleware.gzip import GZipMiddleware # Compresses large JSON responses
+from db import get_db, get_sprites_bucket, get_audio_bucket, lifespan # Shared MongoDB connection (see db.py)
 
 # Initialize the FastAPI app
-app = FastAPI()
+# ORJSONResponse makes every endpoint that returns a dict/list encode it with orjson instead of the slower stdlib json
+# lifespan connects to MongoDB (and creates indexes) on startup and closes the connections on shutdown
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
-# Load environment variables from .env file
-load_dotenv(dotenv_path=".env")  # Explicit path
 
-# Function: Sanitize score update data
-# Purpose: Prevent NoSQL injection by rejecting keys or values with dangerous characters like $, {, or .
-def sanitize_score_update(data: dict) -> dict:
-    for key in data:
-        if "$" in key or "." in key:
-            return None  # Reject dangerous field names
-        value = data[key]
-        if isinstance(value, str) and ("$" in value or "{" in value or "}" in value):
-            return None  # Reject suspicious string values
-    return data  # Return sanitized data if clean
+# Middleware: gzip responses, except the raw file routes
+# Purpose: base64/JSON lists shrink a lot, but PNG and MP3 files are already compressed so gzipping them only costs CPU
+class JSONGZipMiddleware(GZipMiddleware):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith("/content"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
 
 
-# ----------------------------- MONGO DB CONNECTION -----------------------------
+app.add_middleware(JSONGZipMiddleware, minimum_size=1024, compresslevel=5)
 
+logger = logging.getLogger(__name__)
 
-# Use environment variable for MongoDB connection string
-MONGODB_URL = os.getenv("MONGODB_URL")
-print("DEBUG MONGODB_URL:", MONGODB_URL)
+# Pattern: text that is never allowed anywhere in a score update body
+# "$" starts MongoDB operators, "." reaches into nested fields, and a "\u" escape could be used to hide either of them
+UNSAFE_UPDATE_PATTERN = re.compile(rb"[$.]|\\u")
 
+# Pattern: what a player name may look like (letters and numbers only, up to 32 characters)
+# Used by the PlayerScore model and to check names in score updates, so both follow the same rule
+PLAYER_NAME_PATTERN = r"^[A-Za-z0-9]{1,32}$"
+
+# Field types shared by new scores and score updates, so both follow the same rules
+PlayerName = Annotated[str, StringConstraints(pattern=PLAYER_NAME_PATTERN)] # Must be a letters/numbers string (e.g., "Alice")
+ScoreValue = Annotated[int, Field(ge=0, le=10**9)] # Must be a whole number from 0 to 1,000,000,000 (e.g., 4000)
 
-# Dependency function to connect to MongoDB using secure .env config
-async def get_db():
-    client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
-    return client.catgame_db
 
 # Define the expected format for player scores using Pydantic.
 # This ensures incoming POST data is validated for structure and type.
+# player_name may only contain letters and numbers, which blocks NoSQL injection like "$ne"
+# All of these checks run inside pydantic-core while the request body is parsed, and unknown fields are rejected
 class PlayerScore(BaseModel): 
-    player_name: str # Must be a string (e.g., "Alice")
-    score: int # Must be an integer (e.g., 4000)
+    model_config = ConfigDict(extra="forbid")
+
+    player_name: PlayerName
+    score: ScoreValue
+
+
+# Expected format of a score update: the same fields as PlayerScore, but each one is optional
+# strict: the values must already have the right JSON type (no "5000" or true for a score)
+class ScorePatch(BaseModel):
+    model_config = ConfigDict(extra="forbid", strict=True)
+
+    player_name: PlayerName = None
+    score: ScoreValue = None
+
+
+# Function: Check a parsed score update against ScorePatch
+# Returns only the fields that were sent, or None if it isn't a valid, non-empty update
+def validate_score_patch(data) -> dict:
+    try:
+        patch = ScorePatch.model_validate(data).model_dump(exclude_unset=True)
+    except ValidationError:
+        return None
+    return patch or None # An empty update has nothing to $set
+
+# Function: Check and parse the raw JSON body of a score update
+# Purpose: Prevent NoSQL injection with one regex scan over the raw bytes instead of checking every key and value in Python
+# Returns None if the body is unsafe or isn't a valid ScorePatch
+def parse_score_update(body: bytes) -> dict:
+    if UNSAFE_UPDATE_PATTERN.search(body):
+        return None  # Reject dangerous field names and values
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return None
+    return validate_score_patch(data)  # Reject unknown fields, bad player names and scores as well
+
+# Function: Check and parse the raw JSON body of a batch score update
+# Expects a list like [{"id": "...", "patch": {"score": 5000}}, ...], returns None if it is unsafe or malformed
+def parse_score_updates(body: bytes) -> list:
+    if UNSAFE_UPDATE_PATTERN.search(body):
+        return None  # One scan covers every patch in the batch
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(data, list) or not data:
+        return None
+    for item in data:
+        if not isinstance(item, dict) or not ObjectId.is_valid(item.get("id")):
+            return None
+        item["patch"] = validate_score_patch(item.get("patch"))
+        if item["patch"] is None:
+            return None
+    return data
+
+# Function: Turn an id from the URL into an ObjectId
+# Purpose: A malformed id gets a 400 response instead of an InvalidId exception and a 500
+def parse_object_id(id: str) -> ObjectId:
+    if not ObjectId.is_valid(id):
+        raise HTTPException(status_code=400, detail="Invalid id.")
+    return ObjectId(id)
+
+
+# ----------------------------- FILE STORAGE HELPERS -----------------------------
+
+
+# Size of each piece read from an uploaded file before writing it to GridFS (255 KiB)
+# This matches the GridFS chunk size, so every read becomes exactly one stored chunk and nothing is re-buffered
+# Files smaller than this are stored inline in their document as BSON binary instead of in GridFS
+UPLOAD_CHUNK_SIZE = DEFAULT_CHUNK_SIZE
+
+# Largest upload accepted, per request and per file (10 MiB); anything bigger gets a 413 response
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+
+# Most files accepted in one upload request
+MAX_UPLOAD_FILES = 50
+
+# Routes that receive file uploads, their request bodies are limited by UploadSizeLimitMiddleware
+UPLOAD_PATHS = ("/upload_sprites", "/upload_audios")
+
+# Pattern: the boundary that separates the parts (files) of a multipart/form-data body
+MULTIPART_BOUNDARY_REGEX = re.compile(r'boundary="?([^";]+)"?')
+
+# Inline files are compressed with zstd before they are stored (level 3 is fast and still saves most of the space)
+ZSTD_COMPRESSOR = zstandard.ZstdCompressor(level=3)
+ZSTD_DECOMPRESSOR = zstandard.ZstdDecompressor()
+
+# First bytes of file formats that are already compressed (PNG, JPEG, GIF, MP3, OGG, FLAC, ZIP)
+# zstd can't make these any smaller, so they are stored as they are
+COMPRESSED_SIGNATURES = (b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"ID3", b"\xff\xfb", b"\xff\xf3", b"\xff\xf2", b"OggS", b"fLaC", b"PK\x03\x04")
+
+
+# Middleware: Limit the size and number of files of upload requests before their form data is parsed
+# Purpose: a request whose Content-Length is over the limit is rejected before any of it is read,
+# one that sends more than it declared (or uses chunked encoding) is stopped as soon as it goes over,
+# and one with more than MAX_UPLOAD_FILES parts is stopped as soon as the extra part's boundary arrives
+class UploadSizeLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].endswith(UPLOAD_PATHS):
+            await self.app(scope, receive, send)
+            return
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE:
+            response = ORJSONResponse({"detail": "Upload too large."}, status_code=413)
+            await response(scope, receive, send)
+            return
+        match = MULTIPART_BOUNDARY_REGEX.search(Headers(scope=scope).get("content-type", ""))
+        # Every part starts with "--boundary" and a line break (the closing "--boundary--" doesn't)
+        delimiter = b"--" + match.group(1).encode("latin-1") + b"\r\n" if match else None
+        received = 0
+        parts = 0
+        tail = b"" # End of the previous chunk, in case a delimiter is split between two chunks
+
+        async def limited_receive():
+            nonlocal received, parts, tail
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                received += len(body)
+                if received > MAX_UPLOAD_SIZE:
+                    raise HTTPException(status_code=413, detail="Upload too large.")
+                if delimiter is not None:
+                    data = tail + body
+                    parts += data.count(delimiter)
+                    tail = data[-(len(delimiter) - 1):]
+                    if parts > MAX_UPLOAD_FILES:
+                        raise HTTPException(status_code=413, detail=f"Too many files, at most {MAX_UPLOAD_FILES} per upload.")
+            return message
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(UploadSizeLimitMiddleware)
+
+
+# Function: Build the inline fields of a small file
+# Returns {"content": Binary(...), "codec": "zstd"} when compressing saved space, otherwise {"content": Binary(...)}
+def inline_content(content: bytes) -> dict:
+    if not content.startswith(COMPRESSED_SIGNATURES) and content[8:12] != b"WEBP": # Skip already compressed formats
+        compressed = ZSTD_COMPRESSOR.compress(content)
+        if len(compressed) < len(content):
+            return {"content": Binary(compressed), "codec": "zstd"}
+    return {"content": Binary(content)}
+
+
+# Function: Get the raw bytes of a file stored inline in its document, decompressing them if needed
+def read_inline_content(doc: dict) -> bytes:
+    content = doc.get("content", b"")
+    if doc.get("codec") == "zstd":
+        return ZSTD_DECOMPRESSOR.decompress(content)
+    return content
+
+
+# Function: Store an uploaded file
+# Purpose: Small files go straight into their document as (zstd compressed) bytes (no base64, no extra GridFS round-trips),
+# bigger ones are streamed into a GridFS bucket so only one chunk is held in memory at a time
+# Returns the fields to add to the file's document: {"content": Binary(...), ["codec": "zstd"]} or {"file_id": ...}
+async def store_file(bucket, file: UploadFile) -> dict:
+    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    if len(chunk) < UPLOAD_CHUNK_SIZE: # The whole file fit in the first read
+        return inline_content(chunk)
+    grid_in = bucket.open_upload_stream(file.filename, metadata={"content_type": file.content_type})
+    total = 0
+    try:
+        while chunk:
+            total += len(chunk)
+            if total > MAX_UPLOAD_SIZE: # Stop as soon as the file goes over the limit
+                raise HTTPException(status_code=413, detail=f"File {file.filename} is too large.")
+            await grid_in.write(chunk)
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    except Exception:
+        await grid_in.abort() # Remove any chunks already written for this file
+        raise
+    await grid_in.close()
+    return {"file_id": grid_in._id}
+
+
+# Function: Store several uploaded files at the same time
+# If any of them fails, the GridFS files already stored are removed again so no orphan files are left behind
+async def store_files(bucket, files: List[UploadFile]):
+    results = await asyncio.gather(*(store_file(bucket, file) for file in files), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        stored = [r["file_id"] for r in results if not isinstance(r, BaseException) and "file_id" in r]
+        await asyncio.gather(*(bucket.delete(file_id) for file_id in stored))
+        raise errors[0]
+    return results
+
+
+# Function: Load the bytes of a file stored in a GridFS bucket
+async def load_file(bucket, file_id):
+    grid_out = await bucket.open_download_stream(file_id)
+    return await grid_out.read()
+
+
+# Pattern: ASCII whitespace, such as the line breaks some tools put into long base64 strings
+BASE64_WHITESPACE_REGEX = re.compile(r"\s+", re.ASCII)
+
+
+# Function: Decode base64 content sent by clients (or added through Compass) back into raw bytes
+# Raises binascii.Error for anything that isn't valid base64 (apart from whitespace), nothing is silently dropped
+def decode_content(encoded: str) -> bytes:
+    if encoded.startswith("data:"):
+        prefix, comma, encoded = encoded.partition(",") # Strip a "data:image/png;base64," style prefix
+        if not comma:
+            raise binascii.Error("data: URL without a comma")
+    try:
+        return pybase64.b64decode(encoded, validate=True) # Fastest path, for clean base64
+    except binascii.Error:
+        # Slower path for base64 split over several lines: only whitespace is removed, any other stray character is an error
+        return pybase64.b64decode(BASE64_WHITESPACE_REGEX.sub("", encoded), validate=True)
+
+
+# Function: Base64 encode / decode in a worker thread
+# Purpose: Converting a multi-MB file on the event loop would block every other request until it finishes
+async def encode_content_async(content: bytes) -> str:
+    # b64encode_as_string builds the str directly, without an extra bytes copy to decode
+    return await asyncio.get_running_loop().run_in_executor(None, pybase64.b64encode_as_string, content)
+
+
+async def decode_content_async(encoded: str) -> bytes:
+    return await asyncio.get_running_loop().run_in_executor(None, decode_content, encoded)
+
+
+# Function: Decode the base64 'content' of a PUT request
+# Raises a 400 error if it isn't a valid base64 string or decodes to an empty file, so a bad request can't wipe the stored file
+async def parse_content(encoded) -> bytes:
+    if not isinstance(encoded, str):
+        raise HTTPException(status_code=400, detail="Invalid content, expected a base64 string.")
+    try:
+        content = await decode_content_async(encoded)
+    except binascii.Error:
+        raise HTTPException(status_code=400, detail="Invalid content, expected a base64 string.")
+    if not content:
+        raise HTTPException(status_code=400, detail="Invalid content, the file is empty.")
+    return content
+
+
+# Function: Build the response that returns the raw file of a sprite/audio document
+# Small files are inline as raw (possibly zstd compressed) bytes, older documents keep theirs inline as a base64 string,
+# and big files are streamed from GridFS chunk by chunk
+async def content_response(bucket, doc: dict) -> Response:
+    media_type = doc.get("content_type")
+    if "file_id" not in doc:
+        content = doc.get("content", b"")
+        if isinstance(content, str):
+            content = await decode_content_async(content)
+        else:
+            content = read_inline_content(doc)
+        return Response(content=content, media_type=media_type)
+    grid_out = await bucket.open_download_stream(doc["file_id"])
+
+    async def generate():
+        while chunk := await grid_out.readchunk():
+            yield chunk
+    return StreamingResponse(generate(), media_type=media_type, headers={"Content-Length": str(grid_out.length)})
+
+
+# Function: Apply a PUT update to a sprite/audio document
+# New base64 content is decoded and stored as raw bytes (inline if small, otherwise in GridFS),
+# then the document's old GridFS file is removed
+async def update_media(collection, bucket, doc_id: str, updated_data: dict):
+    object_id = parse_object_id(doc_id) # Check the id before storing any new file
+    updated_data.pop("file_id", None) # Only the API decides which GridFS file a document points to
+    updated_data.pop("codec", None) # ...and how its content is stored
+    update = {"$set": updated_data}
+    new_file_id = None
+    if "content" in updated_data:
+        content = await parse_content(updated_data.pop("content"))
+        if len(content) < UPLOAD_CHUNK_SIZE:
+            updated_data.update(inline_content(content))
+            update["$unset"] = {"file_id": ""} if "codec" in updated_data else {"file_id": "", "codec": ""}
+        else:
+            new_file_id = await bucket.upload_from_stream(updated_data.get("name", doc_id), content)
+            updated_data["file_id"] = new_file_id
+            update["$unset"] = {"content": "", "codec": ""} # Drop any old inline copy
+    old = await collection.find_one_and_update({"_id": object_id}, update)
+    if old is None:
+        if new_file_id is not None:
+            await bucket.delete(new_file_id) # No such document, don't leave the new file behind
+    else:
+        await bump_version(collection)
+        if "$unset" in update and "file_id" in old:
+            await bucket.delete(old["file_id"]) # The content was replaced, the old file isn't used anymore
+
+
+# ----------------------------- STREAMING HELPERS -----------------------------
+
+
+# Number of documents MongoDB sends per round-trip when streaming a collection
+STREAM_BATCH_SIZE = 100
+
+# Smaller batches when each document's file is included, since a whole batch of files is loaded at once
+CONTENT_BATCH_SIZE = 10
+
+
+# Function: Convert the values orjson can't serialize on its own
+# orjson only calls this for the ObjectIds it meets while encoding, so no separate pass over the documents is needed
+def json_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError
+
+
+# Function: Stream the documents of a query as a JSON array
+# Purpose: Documents are sent a batch at a time as they arrive instead of building the whole list in memory first
+# If a GridFS bucket is given, each document's file is added as base64 'content' (the files of a batch are loaded together)
+# Clients that send "Accept: application/x-ndjson" get one JSON document per line instead, which they can
+# process as each line arrives rather than waiting for the whole array
+# If content_url is given (e.g. "/sprites/{}/content"), each document gets a 'url' where its file can be downloaded
+def stream_documents(request: Request, cursor, bucket=None, content_url=None):
+    ndjson = "application/x-ndjson" in request.headers.get("accept", "")
+    if content_url is not None:
+        content_url = request.scope.get("root_path", "") + content_url # Keep URLs right if the app is mounted under a prefix
+    batch_size = STREAM_BATCH_SIZE if bucket is None else CONTENT_BATCH_SIZE
+
+    # Turn a list of documents into the bytes to send, 'first' says whether anything was sent before them
+    def dump(docs, first):
+        if ndjson:
+            return b"".join([orjson.dumps(doc, default=json_default, option=orjson.OPT_APPEND_NEWLINE) for doc in docs])
+        return (b"" if first else b",") + b",".join([orjson.dumps(doc, default=json_default) for doc in docs])
+
+    # Add a document's file to it as base64 'content'
+    async def add_content(doc):
+        file_id = doc.pop("file_id", None)
+        if file_id is not None:
+            doc["content"] = await encode_content_async(await load_file(bucket, file_id))
+        elif isinstance(doc.get("content"), bytes):
+            doc["content"] = await encode_content_async(read_inline_content(doc)) # Small file stored inline
+        doc.pop("codec", None) # Clients always get the original bytes
+
+    async def generate():
+        if not ndjson:
+            yield b"["
+        first = True
+        cursor.batch_size(batch_size) # Ask MongoDB for the same number of documents per round-trip
+        # to_list fetches a whole batch per await instead of one document per 'async for' step
+        while docs := await cursor.to_list(length=batch_size):
+            if content_url is not None:
+                for doc in docs:
+                    doc["url"] = content_url.format(doc["_id"])
+            if bucket is not None:
+                # Load the batch's files concurrently instead of waiting for each GridFS read in turn
+                await asyncio.gather(*(add_content(doc) for doc in docs))
+            yield dump(docs, first)
+            first = False
+        if not ndjson:
+            yield b"]"
+    return StreamingResponse(generate(), media_type="application/x-ndjson" if ndjson else "application/json")
+
+
+# ----------------------------- CACHING HELPERS -----------------------------
+
+
+# Recently built sprite/audio lists (without file content), kept for 60 seconds
+# Key: (collection name, Accept header, root_path), value: (etag, body, media_type)
+LIST_CACHE = TTLCache(maxsize=16, ttl=60)
+
+# Number of changes made to each collection by this process, so a list built while a change happened isn't cached
+LIST_CACHE_GENERATIONS = {}
+
+
+# Function: Mark a collection as changed, so clients holding an old ETag for its list download it again
+# Called after every upload, update and delete of sprites/audios; also drops this process's cached lists
+# The cache is only cleared once the new version is stored, so a list read in the meantime can't be cached under the old ETag
+async def bump_version(collection):
+    await collection.database.versions.update_one({"_id": collection.name}, {"$inc": {"version": 1}}, upsert=True)
+    LIST_CACHE_GENERATIONS[collection.name] = LIST_CACHE_GENERATIONS.get(collection.name, 0) + 1
+    for key in [key for key in LIST_CACHE if key[0] == collection.name]:
+        LIST_CACHE.pop(key, None)
+
+
+# Function: Build the ETag of a collection's list response
+# Combines the document count, the newest _id (catches documents added outside the API, e.g. through Compass)
+# and the version counter kept by bump_version, plus anything else that changes the response ('variant')
+async def collection_etag(collection, *variant) -> str:
+    count, newest, version = await asyncio.gather(
+        collection.estimated_document_count(),
+        collection.find_one({}, projection={"_id": 1}, sort=[("_id", -1)]),
+        collection.database.versions.find_one({"_id": collection.name}),
+    )
+    key = f"{count}:{newest and newest['_id']}:{version and version['version']}:{variant}"
+    return '"' + hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + '"'
+
+
+# Function: Check whether the client already has the response with this ETag (If-None-Match header)
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    return any(tag.strip().removeprefix("W/") in (etag, "*") for tag in if_none_match.split(","))
+
+
+# Function: Answer a list request from its ETag
+# Returns 304 Not Modified when the client's copy is still current, otherwise the list with its ETag
+# Lists without file content are served from LIST_CACHE when possible, skipping MongoDB entirely;
+# lists with content are too big to keep in memory and are always streamed
+async def cached_list_response(request: Request, collection, make_response, include_content: bool) -> Response:
+    accept = request.headers.get("accept", "")
+    key = (collection.name, accept, request.scope.get("root_path", ""))
+    cached = None if include_content else LIST_CACHE.get(key)
+    generation = LIST_CACHE_GENERATIONS.get(collection.name) # Taken before the ETag, which must match the cached body
+    if cached is None:
+        etag = await collection_etag(collection, accept, include_content)
+    else:
+        etag, body, media_type = cached
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} # no-cache: clients keep the list but check it with us first
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    if cached is not None:
+        return Response(content=body, media_type=media_type, headers=headers)
+    response = make_response()
+    if include_content:
+        response.headers.update(headers)
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    if LIST_CACHE_GENERATIONS.get(collection.name) == generation: # Nothing changed while the ETag and list were read
+        LIST_CACHE[key] = (etag, body, response.media_type)
+    return Response(content=body, media_type=response.media_type, headers=headers)
 
 
 # ----------------------------- UPLOAD ROUTES -----------------------------
@@ -53,47 +487,50 @@ class PlayerScore(BaseModel):
 # Endpoint: Upload one or more sprite images
 # Method: POST
 # Route: /upload_sprites
-# Accepts multiple image files via form-data, encodes them in base64, and stores them in MongoDB
+# Accepts multiple image files via form-data and stores a document for each in MongoDB
+# (small files inline as zstd compressed bytes unless already compressed, bigger ones streamed into GridFS)
 @app.post("/upload_sprites")
 async def upload_sprites(files: List[UploadFile] = File(...), db=Depends(get_db)):
-    uploaded_ids = [] # Store MongoDB document IDs of inserted sprites
+    documents = [] # One document per sprite, inserted together at the end
     try:
-        for file in files:
-            content = await file.read() # Read file content asynchronously
-            encoded = base64.b64encode(content).decode("utf-8") # Convert to base64 string
-            # Create a document to store
-            document = {
+        stored = await store_files(get_sprites_bucket(), files) # Store all files concurrently
+        for file, fields in zip(files, stored):
+            # Create a document to store (with the file's bytes, or its GridFS id for big files)
+            documents.append({
                 "name": file.filename,
-                "content": encoded,
+                **fields,
                 "content_type": file.content_type # e.g., image/png
-            }
-             # Insert the document into the 'sprites' collection in MongoDB
-            result = await db.sprites.insert_one(document)
-            uploaded_ids.append(str(result.inserted_id))  # Store the generated ObjectId
+            })
+        # Insert all documents into the 'sprites' collection in one round-trip
+        result = await db.sprites.insert_many(documents, ordered=False)
+        await bump_version(db.sprites)
+        uploaded_ids = [str(id) for id in result.inserted_ids] # Store the generated ObjectIds
         return {"message": "Sprites uploaded", "ids": uploaded_ids}
+    except HTTPException:
+        raise # Let size errors reach the client as a proper 413
     except Exception as e:
-        # If something goes wrong, print and return the error
-        print("UPLOAD_SPRITES ERROR:", e) 
+        # If something goes wrong, log and return the error
+        logger.exception("upload_sprites failed")
         return {"error": str(e)}
 
 
 # Endpoint: Upload one or more audio files
 # Method: POST
 # Route: /upload_audios
-# Encodes MP3 files in base64 and stores them in MongoDB
+# Stores a document for each MP3 file in MongoDB (small files inline, bigger ones streamed into GridFS)
 @app.post("/upload_audios")
 async def upload_audios(files: List[UploadFile] = File(...), db=Depends(get_db)):
-    uploaded_ids = []
-    for file in files:
-        content = await file.read() # Read file content asynchronously
-        encoded = base64.b64encode(content).decode("utf-8")  # Convert to base64 string
-        document = {
+    documents = []
+    stored = await store_files(get_audio_bucket(), files) # Store all files concurrently
+    for file, fields in zip(files, stored):
+        documents.append({
             "name": file.filename,
-            "content": encoded,
+            **fields,
             "content_type": file.content_type # e.g., audio/mpeg
-        }
-        result = await db.audio.insert_one(document)
-        uploaded_ids.append(str(result.inserted_id)) # Store the ID of the inserted doc
+        })
+    result = await db.audio.insert_many(documents, ordered=False) # One round-trip for all documents
+    await bump_version(db.audio)
+    uploaded_ids = [str(id) for id in result.inserted_ids] # Store the IDs of the inserted docs
     return {"message": "Audios uploaded", "ids": uploaded_ids}
 
 
@@ -102,17 +539,11 @@ async def upload_audios(files: List[UploadFile] = File(...), db=Depends(get_db))
 # Route: /upload_scores
 # Accepts a list of JSON objects like: [{"player_name": "Alice", "score": 5000}, ...]
 # Validates and inserts them into the 'scores' collection
+# Player names are checked by the PlayerScore model before this runs, invalid ones get a 422 response
 @app.post("/upload_scores")
 async def submit_multiple_scores(scores: List[PlayerScore], db=Depends(get_db)):
-    # Basic sanitization: prevent NoSQL injection by disallowing special characters
-    clean_scores = []
-    for score in scores:
-        if not score.player_name.isalnum():  # Reject suspicious names like "$ne"
-            raise HTTPException(status_code=400, detail="Invalid player name.")
-        clean_scores.append(score.dict())
-    
-    # Insert all valid scores into the 'scores' collection
-    results = await db.scores.insert_many(clean_scores)
+    # Insert all valid scores into the 'scores' collection (the generator is consumed once by insert_many, no extra list)
+    results = await db.scores.insert_many((score.model_dump() for score in scores), ordered=False)
     return {"message": "Multiple scores submitted", "ids": [str(id) for id in results.inserted_ids]}
 
 
@@ -122,42 +553,88 @@ async def submit_multiple_scores(scores: List[PlayerScore], db=Depends(get_db)):
 # Endpoint: Retrieve all sprite images
 # Method: GET
 # Route: /sprites
-# Returns a list of documents containing name, content (base64), and content_type
+# Returns a list of documents containing name, content_type and url (where the image can be downloaded), streamed
+# Add ?include_content=true to also get each image as base64 'content'
+# Sends an ETag; clients that send it back in If-None-Match get 304 Not Modified while nothing changed
 @app.get("/sprites")
-async def get_sprites(db=Depends(get_db)):
-    sprites = []
-    cursor = db.sprites.find() # Query all documents in the 'sprites' collection
-    async for doc in cursor:
-        doc["_id"] = str(doc["_id"])  # Convert ObjectId to string so it can be serialized in JSON
-        sprites.append(doc)
-    return sprites
+async def get_sprites(request: Request, include_content: bool = False, db=Depends(get_db)):
+    content_url = "/sprites/{}/content"
+
+    def make_response():
+        if include_content:
+            return stream_documents(request, db.sprites.find(), get_sprites_bucket(), content_url)
+        # Query all documents in the 'sprites' collection, leaving out the file data
+        cursor = db.sprites.find({}, projection={"content": 0, "file_id": 0, "codec": 0})
+        return stream_documents(request, cursor, content_url=content_url)
+    return await cached_list_response(request, db.sprites, make_response, include_content)
 
 
 # Endpoint: Retrieve all audio files
 # Method: GET
 # Route: /audios
-# Returns list of audio records with base64-encoded data
+# Returns list of audio records (name, content_type and url where the file can be downloaded), streamed
+# Add ?include_content=true to also get each file as base64 'content'
+# Sends an ETag; clients that send it back in If-None-Match get 304 Not Modified while nothing changed
 @app.get("/audios")
-async def get_audios(db=Depends(get_db)):
-    audios = []
-    cursor = db.audio.find() # Query all documents in the 'audios' collection
-    async for doc in cursor:
-        doc["_id"] = str(doc["_id"])  # Convert ObjectId to string so it can be serialized in JSON
-        audios.append(doc)
-    return audios
+async def get_audios(request: Request, include_content: bool = False, db=Depends(get_db)):
+    content_url = "/audios/{}/content"
+
+    def make_response():
+        if include_content:
+            return stream_documents(request, db.audio.find(), get_audio_bucket(), content_url)
+        # Query all documents in the 'audio' collection, leaving out the file data
+        cursor = db.audio.find({}, projection={"content": 0, "file_id": 0, "codec": 0})
+        return stream_documents(request, cursor, content_url=content_url)
+    return await cached_list_response(request, db.audio, make_response, include_content)
+
+# Endpoint: Retrieve the file of one sprite
+# Method: GET
+# Route: /sprites/{sprite_id}/content
+# Streams the raw image bytes with their content type (e.g., image/png), no base64 involved
+@app.get("/sprites/{sprite_id}/content")
+async def get_sprite_content(sprite_id: str, db=Depends(get_db)):
+    doc = await db.sprites.find_one({"_id": parse_object_id(sprite_id)})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Sprite not found.")
+    return await content_response(get_sprites_bucket(), doc)
+
+# Endpoint: Retrieve the file of one audio
+# Method: GET
+# Route: /audios/{audio_id}/content
+# Streams the raw audio bytes with their content type (e.g., audio/mpeg)
+@app.get("/audios/{audio_id}/content")
+async def get_audio_content(audio_id: str, db=Depends(get_db)):
+    doc = await db.audio.find_one({"_id": parse_object_id(audio_id)})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Audio not found.")
+    return await content_response(get_audio_bucket(), doc)
+
+# Largest number of scores a client can ask for with ?limit= or ?n=
+MAX_SCORES_LIMIT = 1000
+
 
 # Endpoint: Retrieve all player scores
 # Method: GET
 # Route: /scores
-# Returns documents with player_name and score values
+# Returns documents with _id, player_name and score values, highest score first, streamed one by one
+# Add ?limit=N (max 1000) to only get the first N
 @app.get("/scores")
-async def get_scores(db=Depends(get_db)):
-    scores = []
-    cursor = db.scores.find() # Query all documents in the 'scores' collection
-    async for doc in cursor:
-        doc["_id"] = str(doc["_id"]) # Convert ObjectId
-        scores.append(doc)
-    return scores
+async def get_scores(request: Request, limit: Optional[int] = Query(None, ge=1, le=MAX_SCORES_LIMIT), db=Depends(get_db)):
+    # Query the 'scores' collection, sorted by the score index so MongoDB can stop after 'limit' documents
+    cursor = db.scores.find({}, projection={"player_name": 1, "score": 1}).sort("score", -1)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return stream_documents(request, cursor)
+
+# Endpoint: Retrieve the leaderboard
+# Method: GET
+# Route: /scores/top
+# Returns the n highest scores (default 100, max 1000) as player_name and score, best first
+# The (score, player_name) index holds everything this query needs, so MongoDB answers it from the index alone
+@app.get("/scores/top")
+async def get_top_scores(request: Request, n: int = Query(100, ge=1, le=MAX_SCORES_LIMIT), db=Depends(get_db)):
+    cursor = db.scores.find({}, projection={"_id": 0, "player_name": 1, "score": 1}).sort("score", -1).limit(n)
+    return stream_documents(request, cursor)
 
 
 
@@ -167,31 +644,45 @@ async def get_scores(db=Depends(get_db)):
 # Endpoint: Update a specific sprite document by ID
 # Method: PUT
 # Route: /sprites/{sprite_id}
-# Accepts JSON with updated fields (e.g., name, content), and updates the sprite in MongoDB
+# Accepts JSON with updated fields (e.g., name, content as base64), and updates the sprite in MongoDB
 @app.put("/sprites/{sprite_id}")
 async def update_sprite(sprite_id: str, updated_data: dict, db=Depends(get_db)):
-    await db.sprites.update_one({"_id": ObjectId(sprite_id)}, {"$set": updated_data})
+    await update_media(db.sprites, get_sprites_bucket(), sprite_id, updated_data)
     return {"message": "Sprite updated"}
 
 # Endpoint: Update a specific audio document by ID
 # Method: PUT
 # Route: /audios/{audio_id}
-# Accepts JSON with updated fields (e.g., name, content), and updates the audio in MongoDB
+# Accepts JSON with updated fields (e.g., name, content as base64), and updates the audio in MongoDB
 @app.put("/audios/{audio_id}")
 async def update_audio(audio_id: str, updated_data: dict, db=Depends(get_db)):
-    await db.audio.update_one({"_id": ObjectId(audio_id)}, {"$set": updated_data})
+    await update_media(db.audio, get_audio_bucket(), audio_id, updated_data)
     return {"message": "Audio updated"}
 
+# Endpoint: Update many score documents at once
+# Method: PUT
+# Route: /scores
+# Accepts JSON like [{"id": "...", "patch": {"score": 5000}}, ...] and applies all updates in one round-trip
+# Prefer this over calling PUT /scores/{score_id} once per score
+@app.put("/scores")
+async def update_scores(request: Request, db=Depends(get_db)):
+    updates = parse_score_updates(await request.body())
+    if updates is None:
+        raise HTTPException(status_code=400, detail="Invalid or unsafe data")
+    operations = [UpdateOne({"_id": ObjectId(update["id"])}, {"$set": update["patch"]}) for update in updates]
+    result = await db.scores.bulk_write(operations, ordered=False)
+    return {"message": "Scores updated", "matched": result.matched_count, "modified": result.modified_count}
+
 # Endpoint: Update a specific score document by ID
 # Method: PUT
 # Route: /scores/{score_id}
-# Accepts JSON with fields like player_name and score. Sanitizes input before updating.
+# Accepts JSON with fields like player_name and score. Sanitizes the raw body before updating.
 @app.put("/scores/{score_id}")
-async def update_score(score_id: str, updated_data: dict, db=Depends(get_db)):
-    sanitized = sanitize_score_update(updated_data)
+async def update_score(score_id: str, request: Request, db=Depends(get_db)):
+    sanitized = parse_score_update(await request.body())
     if sanitized is None:
-        return {"message": "Invalid or unsafe data"}
-    await db.scores.update_one({"_id": ObjectId(score_id)}, {"$set": sanitized})
+        raise HTTPException(status_code=400, detail="Invalid or unsafe data")
+    await db.scores.update_one({"_id": parse_object_id(score_id)}, {"$set": sanitized})
     return {"message": "Score updated"}
 
 
@@ -201,19 +692,27 @@ async def update_score(score_id: str, updated_data: dict, db=Depends(get_db)):
 # Endpoint: Delete a specific sprite document by ID
 # Method: DELETE
 # Route: /sprites/{sprite_id}
-# Deletes the sprite from the 'sprites' collection
+# Deletes the sprite from the 'sprites' collection and its file from GridFS
 @app.delete("/sprites/{sprite_id}")
 async def delete_sprite(sprite_id: str, db=Depends(get_db)):
-    await db.sprites.delete_one({"_id": ObjectId(sprite_id)})
+    doc = await db.sprites.find_one_and_delete({"_id": parse_object_id(sprite_id)})
+    if doc:
+        await bump_version(db.sprites)
+        if "file_id" in doc:
+            await get_sprites_bucket().delete(doc["file_id"]) # Remove the file's chunks from GridFS
     return {"message": "Sprite deleted"}
 
 # Endpoint: Delete a specific audio document by ID
 # Method: DELETE
 # Route: /audios/{audio_id}
-# Deletes the audio file from the 'audio' collection
+# Deletes the audio file from the 'audio' collection and from GridFS
 @app.delete("/audios/{audio_id}")
 async def delete_audio(audio_id: str, db=Depends(get_db)):
-    await db.audio.delete_one({"_id": ObjectId(audio_id)})
+    doc = await db.audio.find_one_and_delete({"_id": parse_object_id(audio_id)})
+    if doc:
+        await bump_version(db.audio)
+        if "file_id" in doc:
+            await get_audio_bucket().delete(doc["file_id"]) # Remove the file's chunks from GridFS
     return {"message": "Audio deleted"}
 
 # Endpoint: Delete a specific score document by ID
@@ -222,7 +721,7 @@ async def delete_audio(audio_id: str, db=Depends(get_db)):
 # Deletes the score record from the 'scores' collection
 @app.delete("/scores/{score_id}")
 async def delete_score(score_id: str, db=Depends(get_db)):
-    await db.scores.delete_one({"_id": ObjectId(score_id)})
+    await db.scores.delete_one({"_id": parse_object_id(score_id)})
     return {"message": "Score deleted"}
 
 